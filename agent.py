@@ -8,62 +8,168 @@ import threading
 from minecraft.networking.connection import Connection
 from minecraft.networking.packets import ChatMessagePacket, Packet
 from minecraft.networking.packets import clientbound
+from minecraft.networking.packets.serverbound.play import KeepAlivePacket as ServerboundKeepAlive
 from minecraft.exceptions import YggdrasilError
 import json
+import re
 import datetime
+import logging
+import logging.handlers
 import sqlite3
+import copy
+import queue
+import atexit
+import functools
+from collections import OrderedDict
+from sortedcontainers import SortedList
+
+# orjson is much faster on the chat hot path; fall back to the stdlib parser
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 LOG_PATH = "agent.log"
 MEMORY_DB = "agent_memory.db"
+PLAYERS_PATH = "players.json"
 
 # Global control variables
 running = True
 connection_active = False
+shutdown_event = threading.Event()
+disconnect_event = threading.Event()
+
+# LLM replies run on a small pool of daemon worker threads, off the networking
+# thread. Daemon threads don't hold up interpreter exit, so a slow OpenAI call
+# in flight can't delay shutdown.
+_LLM_WORKERS = 4
+_llm_queue = queue.Queue()
 
 # Logging
+# A single rotating handler keeps the file open, serializes writes from all
+# threads and caps the log size so the dashboard's tail read stays cheap
+logger = logging.getLogger("agent")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_formatter = logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+for _handler in (logging.handlers.RotatingFileHandler(LOG_PATH, maxBytes=5_000_000, backupCount=3),
+                 logging.StreamHandler(sys.stdout)):
+    _handler.setFormatter(_log_formatter)
+    logger.addHandler(_handler)
+
+# Route uncaught exceptions (main and worker threads) into the rotating log so
+# crash tracebacks show up in the dashboard alongside everything else
+def _log_uncaught(exc_type, exc_value, exc_traceback):
+    if issubclass(exc_type, KeyboardInterrupt):
+        sys.__excepthook__(exc_type, exc_value, exc_traceback)
+        return
+    logger.error("Uncaught exception", exc_info=(exc_type, exc_value, exc_traceback))
+
+sys.excepthook = _log_uncaught
+threading.excepthook = lambda args: _log_uncaught(args.exc_type, args.exc_value, args.exc_traceback)
+
 def log(msg):
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    line = f"[{timestamp}] {msg}"
-    print(line)
-    with open(LOG_PATH, "a") as f:
-        f.write(line + "\n")
+    logger.info(msg)
 
 # Persistent memory (SQLite)
+# One shared connection for the process; writes are serialized by _db_lock
+_db_conn = sqlite3.connect(MEMORY_DB, check_same_thread=False, isolation_level=None)
+_db_lock = threading.Lock()
+atexit.register(_db_conn.close)
+
 def init_memory():
-    conn = sqlite3.connect(MEMORY_DB)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            sender TEXT,
-            message TEXT
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS facts (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
+    with _db_lock:
+        c = _db_conn.cursor()
+        # WAL lets readers run alongside the chat writer; NORMAL syncs only at
+        # checkpoints instead of on every commit
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        c.execute("PRAGMA temp_store=MEMORY")
+        c.execute("PRAGMA mmap_size=268435456")  # Memory-map up to 256MB of the DB
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                sender TEXT,
+                message TEXT
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS facts (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+
+# Chat rows are queued and written by a single background thread in batches
+_CHAT_BATCH_SIZE = 50
+_CHAT_FLUSH_INTERVAL = 0.1  # seconds
+_chat_queue = queue.Queue()
 
 def save_chat(sender, message):
-    conn = sqlite3.connect(MEMORY_DB)
-    c = conn.cursor()
-    c.execute("INSERT INTO chat_history (timestamp, sender, message) VALUES (?, ?, ?)",
-              (datetime.datetime.now().isoformat(), sender, message))
-    conn.commit()
-    conn.close()
+    _chat_queue.put((datetime.datetime.now().isoformat(), sender, message))
+
+def _chat_writer():
+    """Drain the chat queue, inserting each batch in a single transaction"""
+    done = False
+    while not done:
+        rows = []
+        item = _chat_queue.get()
+        deadline = time.monotonic() + _CHAT_FLUSH_INTERVAL
+        while True:
+            if item is None:  # Shutdown sentinel
+                done = True
+                break
+            rows.append(item)
+            if len(rows) >= _CHAT_BATCH_SIZE:
+                break
+            try:
+                item = _chat_queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+        if rows:
+            with _db_lock:
+                try:
+                    _db_conn.execute("BEGIN")
+                    _db_conn.executemany("INSERT INTO chat_history (timestamp, sender, message) VALUES (?, ?, ?)", rows)
+                    _db_conn.execute("COMMIT")
+                except sqlite3.Error as e:
+                    if _db_conn.in_transaction:
+                        _db_conn.execute("ROLLBACK")
+                    log(f"Error saving chat history: {e}")
+
+def flush_chat():
+    """Write any queued chat rows and stop the writer thread"""
+    if _chat_writer_thread.is_alive():
+        _chat_queue.put(None)
+        _chat_writer_thread.join(timeout=5)
 
 init_memory()
+_chat_writer_thread = threading.Thread(target=_chat_writer, daemon=True)
+_chat_writer_thread.start()
 
 # Load config
+# Parsed configs are cached by path and only re-parsed when mtime or size changes
+_YAML_CACHE_MAX = 100
+_yaml_cache = OrderedDict()  # path -> (mtime, size, parsed dict)
+# Prefer the libyaml-backed C loader when PyYAML was built with it
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 def load_config(path="config.yaml"):
     log(f"Loading config from {path}")
+    stat = os.stat(path)
+    cached = _yaml_cache.get(path)
+    if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        _yaml_cache.move_to_end(path)
+        return copy.deepcopy(cached[2])
     with open(path, 'r') as f:
-        return yaml.safe_load(f)
+        data = yaml.load(f, Loader=_YamlLoader)
+    _yaml_cache[path] = (stat.st_mtime, stat.st_size, data)
+    _yaml_cache.move_to_end(path)
+    if len(_yaml_cache) > _YAML_CACHE_MAX:
+        _yaml_cache.popitem(last=False)
+    return copy.deepcopy(data)
 
 config = load_config()
 
@@ -74,6 +180,7 @@ openai_model = config['openai']['model']
 server_host = config['minecraft']['server_host']
 server_port = config['minecraft']['server_port']
 username = config['minecraft']['username']
+_username_lower = username.lower()
 password = os.getenv("MINECRAFT_PASSWORD", config['minecraft']['password'])
 
 db_path = config['memory']['db_path']
@@ -90,33 +197,70 @@ def handle_shutdown(signum=None, frame=None):
     global running
     log("Shutting down agent...")
     running = False
+    shutdown_event.set()
+    disconnect_event.set()  # Wake the connection monitor so it can exit
     if conn and conn.connected:
         conn.disconnect()
+    flush_chat()
+    online_players.clear()
+    write_players()
     log("Agent shutdown complete.")
 
 # Register signal handlers for graceful shutdown
 signal.signal(signal.SIGINT, handle_shutdown)
 signal.signal(signal.SIGTERM, handle_shutdown)
 
-# Track online players
-online_players = set()
+# Player info packet class, resolved once: newer pyCraft calls it PlayerListItemPacket,
+# older versions PlayerInfoPacket
+try:
+    from minecraft.networking.packets.clientbound.play import PlayerListItemPacket as PlayerInfoPacket
+except ImportError:
+    PlayerInfoPacket = getattr(clientbound.play, 'PlayerInfoPacket', None)
+
+# Track online players, kept sorted; the joined display string is rebuilt only after a change
+online_players = SortedList()
+_players_text = None
 
 def log_players():
-    log(f"Online players: {', '.join(sorted(online_players)) if online_players else '[none]'}")
+    global _players_text
+    players_text = _players_text
+    if players_text is None:
+        players_text = ', '.join(online_players) if online_players else '[none]'
+        # Only mark the cache fresh once players.json is written, so a failed
+        # write is retried on the next call
+        if write_players():
+            _players_text = players_text
+    log(f"Online players: {players_text}")
+
+def write_players():
+    """Atomically publish the player list for the dashboard; returns True on success"""
+    tmp_path = PLAYERS_PATH + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump({"players": list(online_players)}, f)
+        os.replace(tmp_path, PLAYERS_PATH)
+    except OSError as e:
+        log(f"Error writing {PLAYERS_PATH}: {e}")
+        return False
+    return True
 
 # Listen for player info packets
 def handle_player_info(packet):
     # In newer pyCraft versions, it's PlayerListItemPacket
+    global _players_text
     try:
         for action in packet.actions:
             if action.name == 'ADD_PLAYER':
                 for info in packet.player_infos:
-                    online_players.add(info.name)
+                    if info.name not in online_players:
+                        online_players.add(info.name)
+                        _players_text = None
                     log(f"Player joined: {info.name}")
             elif action.name == 'REMOVE_PLAYER':
                 for info in packet.player_infos:
                     if info.name in online_players:
                         online_players.remove(info.name)
+                        _players_text = None
                         log(f"Player left: {info.name}")
         log_players()
     except Exception as e:
@@ -124,19 +268,11 @@ def handle_player_info(packet):
 
 def register_packet_listeners(connection):
     """Register all packet listeners on the connection"""
-    # Try both potential packet names for player info
-    try:
-        # First try the newer PlayerListItemPacket (most versions)
-        from minecraft.networking.packets.clientbound.play import PlayerListItemPacket
-        connection.register_packet_listener(handle_player_info, PlayerListItemPacket)
-        log("Registered PlayerListItemPacket listener")
-    except (ImportError, AttributeError):
-        try:
-            # Fall back to older PlayerInfoPacket name
-            connection.register_packet_listener(handle_player_info, clientbound.play.PlayerInfoPacket)
-            log("Registered PlayerInfoPacket listener")
-        except (ImportError, AttributeError):
-            log("Warning: Could not register player info packet listener")
+    if PlayerInfoPacket is not None:
+        connection.register_packet_listener(handle_player_info, PlayerInfoPacket)
+        log(f"Registered {PlayerInfoPacket.__name__} listener")
+    else:
+        log("Warning: Could not register player info packet listener")
 
     connection.register_packet_listener(handle_chat, ChatMessagePacket)
 
@@ -159,28 +295,41 @@ def send_chat(msg):
     conn.write_packet(packet)
 
 # Command parser
+# Example: "AgentBot1, say hello!" -> ("say", "hello!"); add more commands to the alternation
+_cmd_re = re.compile(
+    rf"^{re.escape(username)}[,:\s]*(?:say (?P<say>.*\S)|(?P<jump>jump))",
+    re.IGNORECASE,
+)
+
 def parse_command(msg_text):
-    # Example: "AgentBot1, say hello!"
-    if msg_text.lower().startswith(username.lower()):
-        cmd = msg_text[len(username):].strip().lstrip(",: ")
-        if cmd.lower().startswith("say "):
-            return ("say", cmd[4:])
-        elif cmd.lower().startswith("jump"):
-            return ("jump", None)
-        # Add more commands here
-    return (None, None)
+    m = _cmd_re.match(msg_text)
+    if m is None:
+        return (None, None)
+    if m['jump']:
+        return ("jump", None)
+    return ("say", m['say'])
 
 # Handle chat messages received from the server
 def handle_chat(packet):
-    try:
-        # Minecraft 1.19+ uses JSON chat, older versions use plain text
-        data = json.loads(packet.json_data)
-        if 'extra' in data:
-            msg_text = ''.join([part.get('text', '') for part in data['extra']])
-        else:
-            msg_text = data.get('text', '')
-    except Exception:
-        msg_text = getattr(packet, 'message', str(packet))
+    # Minecraft 1.19+ uses JSON chat, older versions use plain text.
+    # Only attempt a parse when the payload looks like a JSON object, so plain
+    # text never pays for building a decode exception.
+    msg_text = None
+    json_data = getattr(packet, 'json_data', None)
+    if json_data and json_data[:1] in ('{', b'{'):
+        try:
+            data = _json_loads(json_data)
+            extra = data.get('extra')
+            if extra:
+                msg_text = ''.join(part.get('text', '') for part in extra)
+            else:
+                msg_text = data.get('text', '')
+        except (json.JSONDecodeError, AttributeError, TypeError):
+            # Malformed JSON, or JSON that isn't the chat shape we expect
+            # (bare-string or null 'extra' parts, non-list 'extra', ...)
+            msg_text = None
+    if not isinstance(msg_text, str):
+        msg_text = str(getattr(packet, 'message', packet))
     log(f"[CHAT RECEIVED] {msg_text}")
     save_chat("player", msg_text)
     # Command parsing
@@ -189,27 +338,48 @@ def handle_chat(packet):
         send_chat(arg)
     elif cmd == "jump":
         send_chat("*jumps*")
-    elif username.lower() in msg_text.lower() or 'agentbot' in msg_text.lower():
-        prompt = f"You are a helpful Minecraft agent. The user said: {msg_text}. Reply as the agent in Minecraft chat."
-        try:
-            log(f"Sending message to OpenAI: {msg_text}")
-            response = openai.ChatCompletion.create(
-                model=openai_model,
-                messages=[{"role": "system", "content": "You are a helpful Minecraft agent."},
-                          {"role": "user", "content": msg_text}]
-            )
-            reply = response.choices[0].message['content'].strip()
-            log(f"OpenAI reply: {reply}")
-            send_chat(reply[:256])  # Minecraft chat limit
-        except Exception as e:
-            log(f"[OpenAI Error] {e}")
-            send_chat("[Agent Error] Could not process your request.")
+    elif _username_lower in (msg_lower := msg_text.lower()) or 'agentbot' in msg_lower:
+        # Don't block the packet listener thread on the OpenAI round-trip
+        _llm_queue.put(msg_text)
+
+_SYSTEM_MSG = {"role": "system", "content": "You are a helpful Minecraft agent."}
+_MAX_PROMPT_CHARS = 500  # Caps token cost and latency for very long chat lines
+
+# Repeated messages reuse the earlier reply instead of another OpenAI call;
+# failures raise and so are never cached
+@functools.lru_cache(maxsize=512)
+def _cached_reply(model, msg_text):
+    log(f"Sending message to OpenAI: {msg_text}")
+    response = openai.ChatCompletion.create(
+        model=model,
+        messages=[_SYSTEM_MSG, {"role": "user", "content": msg_text}]
+    )
+    return response.choices[0].message['content'].strip()
+
+def _run_llm_reply(msg_text):
+    try:
+        reply = _cached_reply(openai_model, msg_text[:_MAX_PROMPT_CHARS])
+        log(f"OpenAI reply: {reply}")
+        send_chat(reply[:256])  # Minecraft chat limit
+    except Exception as e:
+        log(f"[OpenAI Error] {e}")
+        send_chat("[Agent Error] Could not process your request.")
+
+def _llm_worker():
+    while True:
+        msg_text = _llm_queue.get()
+        if running:  # Drop requests still queued once shutdown has started
+            _run_llm_reply(msg_text)
+
+for _ in range(_LLM_WORKERS):
+    threading.Thread(target=_llm_worker, name="llm", daemon=True).start()
 
 # Add new event handlers
 def handle_disconnect(packet, connection):
     """Handle server disconnect packet"""
     global connection_active
     connection_active = False
+    disconnect_event.set()
     reason = getattr(packet, 'json_data', None)
     if reason:
         try:
@@ -225,8 +395,7 @@ def handle_keepalive(packet, connection):
     try:
         if hasattr(packet, 'keep_alive_id'):
             # Respond with the same ID to keep the connection alive
-            from minecraft.networking.packets import serverbound
-            response = serverbound.play.KeepAlivePacket()
+            response = ServerboundKeepAlive()
             response.keep_alive_id = packet.keep_alive_id
             connection.write_packet(response)
     except Exception as e:
@@ -282,14 +451,16 @@ def connection_monitor():
     reconnect_delay = 10  # seconds
     
     while running:
-        if not connection_active and running:
+        # Sleep until handle_disconnect (or shutdown) signals us
+        disconnect_event.wait()
+        disconnect_event.clear()
+        while running and not connection_active:
             log("Connection lost. Attempting to reconnect...")
             if connect_to_server():
                 log("Reconnection successful!")
             else:
                 log(f"Reconnection failed. Will try again in {reconnect_delay} seconds.")
-                time.sleep(reconnect_delay)
-        time.sleep(5)  # Check connection status every 5 seconds
+                shutdown_event.wait(reconnect_delay)
 
 # Start the agent
 try:
@@ -299,9 +470,8 @@ try:
         monitor_thread = threading.Thread(target=connection_monitor, daemon=True)
         monitor_thread.start()
         
-        # Main loop - keep the script running but don't block with empty loop
-        while running:
-            time.sleep(1)
+        # Main loop - block until shutdown is requested instead of polling
+        shutdown_event.wait()
     else:
         log("Failed to establish initial connection. Exiting.")
 except KeyboardInterrupt:
@@ -1,4 +1,5 @@
 import streamlit as st
+import asyncio
 import yaml
 import os
 import subprocess
@@ -8,49 +9,110 @@ import openai
 import socket
 import json
 import hashlib
+import heapq
 from mcstatus import JavaServer
 import re
 from pathlib import Path
 import base64
+from collections import deque
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
+# orjson encodes straight to bytes; fall back to the stdlib encoder
+try:
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj):
+        return json.dumps(obj).encode()
+    _json_loads = json.loads
+
 CONFIG_PATH = "config.yaml"
 SECRETS_PATH = ".agent_secrets.enc"
 AGENT_PROCESS = None
 LOG_PATH = "agent.log"
-SALT = b'minecraft_agent_salt'  # Not truly secure but better than plaintext
+STDERR_LOG_PATH = "agent.stderr.log"
+PLAYERS_PATH = "players.json"
+API_KEY_CHECK_PATH = ".api_key_check.json"
+API_KEY_CHECK_TTL = 3600  # seconds
+DEFAULT_MODELS = ("gpt-4o", "gpt-4", "gpt-3.5-turbo", "o4-mini", "o3")
+SALT = b'minecraft_agent_salt'  # Only for secrets files written before per-install salts
+
+# Prefer the libyaml-backed C loader/dumper when PyYAML was built with it
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# Parsed configs live in Streamlit's cache, which (unlike module globals)
+# survives reruns; mtime and size are part of the key so edits are re-parsed
+@st.cache_data(max_entries=100, show_spinner=False)
+def _parse_config(path, mtime_ns, size):
+    with open(path, 'r') as f:
+        return yaml.load(f, Loader=_YamlLoader)
 
 # Helper to load config
-def load_config():
-    with open(CONFIG_PATH, 'r') as f:
-        return yaml.safe_load(f)
+def load_config(path=CONFIG_PATH):
+    stat = os.stat(path)
+    return _parse_config(path, stat.st_mtime_ns, stat.st_size)
 
 def save_config(config):
     with open(CONFIG_PATH, 'w') as f:
-        yaml.safe_dump(config, f)
+        yaml.dump(config, f, Dumper=_YamlDumper)
+    # Same-size rewrites can keep the mtime on coarse-timestamp filesystems
+    _parse_config.clear()
         
 # Helper functions for secure credential storage
-def get_encryption_key(password):
+# Secrets file layouts, identified by the first byte:
+#   0x03 + 16-byte per-install salt + Fernet token (scrypt key)
+#   0x02 + Fernet token (scrypt key, global SALT)
+#   bare Fernet token, always starting with 'g' (PBKDF2 key, global SALT)
+SECRETS_VERSION_SALTED = b'\x03'
+SECRETS_VERSION_SCRYPT = b'\x02'
+SECRETS_SALT_LEN = 16
+
+def get_encryption_key(password, salt=SALT, legacy=False):
     """Generate an encryption key from password"""
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=SALT,
-        iterations=100000,
-    )
-    key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
-    return key
+    if legacy:
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=100000,
+        )
+        return base64.urlsafe_b64encode(kdf.derive(password.encode()))
+    # scrypt is memory-hard (32MB at these parameters), unlike PBKDF2
+    key = hashlib.scrypt(password.encode(), salt=salt, n=2**15, r=8, p=1,
+                         maxmem=64 * 1024 * 1024, dklen=32)
+    return base64.urlsafe_b64encode(key)
+
+def _get_fernet(password, salt=SALT, legacy=False):
+    """Return a Fernet for password, deriving the key at most once per session"""
+    cache_key = (legacy, salt, hashlib.sha256(password.encode()).digest())
+    cache = st.session_state.setdefault("_fernet_cache", {})
+    if cache_key not in cache:
+        cache[cache_key] = Fernet(get_encryption_key(password, salt, legacy))
+    return cache[cache_key]
+
+def _read_secrets_salt():
+    """Return this install's salt from the secrets file, or None if it has none yet"""
+    try:
+        with open(SECRETS_PATH, 'rb') as file:
+            header = file.read(1 + SECRETS_SALT_LEN)
+    except FileNotFoundError:
+        return None
+    if header[:1] == SECRETS_VERSION_SALTED and len(header) == 1 + SECRETS_SALT_LEN:
+        return header[1:]
+    return None
 
 def save_secrets(data, password):
     """Encrypt and save secrets"""
     try:
-        key = get_encryption_key(password)
-        f = Fernet(key)
-        encrypted_data = f.encrypt(json.dumps(data).encode())
+        salt = _read_secrets_salt() or os.urandom(SECRETS_SALT_LEN)
+        f = _get_fernet(password, salt)
+        encrypted_data = f.encrypt(_json_dumps(data))
         with open(SECRETS_PATH, 'wb') as file:
-            file.write(encrypted_data)
+            file.write(SECRETS_VERSION_SALTED + salt + encrypted_data)
         return True
     except Exception as e:
         st.error(f"Failed to save secrets: {e}")
@@ -62,41 +124,87 @@ def load_secrets(password):
         if not Path(SECRETS_PATH).exists():
             return {}
         
-        key = get_encryption_key(password)
-        f = Fernet(key)
         with open(SECRETS_PATH, 'rb') as file:
             encrypted_data = file.read()
+        version = encrypted_data[:1]
+        if version == SECRETS_VERSION_SALTED:
+            salt = encrypted_data[1:1 + SECRETS_SALT_LEN]
+            f = _get_fernet(password, salt)
+            encrypted_data = encrypted_data[1 + SECRETS_SALT_LEN:]
+        elif version == SECRETS_VERSION_SCRYPT:
+            f = _get_fernet(password)
+            encrypted_data = encrypted_data[1:]
+        else:
+            f = _get_fernet(password, legacy=True)
         decrypted_data = f.decrypt(encrypted_data)
-        return json.loads(decrypted_data)
+        return _json_loads(decrypted_data)
     except Exception as e:
         # Could be wrong password or corrupted file
         return {}
 
-# Fetch recent OpenAI models
+# One OpenAI client per API key, reused across reruns so its connection pool stays warm
+@st.cache_resource(max_entries=8)
+def get_openai_client(api_key):
+    return openai.OpenAI(api_key=api_key)
+
+# Fetch recent OpenAI models. Only successful lookups are cached (per API key):
+# _fetch_openai_models raises on failure, so st.cache_data stores nothing.
+@st.cache_data(ttl=3600, max_entries=8, show_spinner=False)
+def _fetch_openai_models(api_key):
+    models_data = get_openai_client(api_key).models.list().data
+    # Ten newest matching models; a bounded heap avoids sorting the full list
+    newest = heapq.nlargest(10, (m for m in models_data if 'gpt' in m.id or 'o' in m.id),
+                            key=lambda m: getattr(m, 'created', 0))
+    return [m.id for m in newest]
+
 def get_openai_models(api_key):
+    if not api_key:
+        return list(DEFAULT_MODELS)
     try:
-        openai.api_key = api_key
-        models = openai.models.list()
-        sorted_models = sorted(models.data, key=lambda m: getattr(m, 'created', 0), reverse=True)
-        model_ids = [m.id for m in sorted_models if 'gpt' in m.id or 'o' in m.id]
-        return model_ids[:10]
+        return _fetch_openai_models(api_key)
     except Exception as e:
-        return ["gpt-4o", "gpt-4", "gpt-3.5-turbo", "o4-mini", "o3"]
+        return list(DEFAULT_MODELS)
 
-# Test OpenAI API Key
+# Test OpenAI API Key (cached briefly so repeated presses don't hit the API).
+# Successful checks are also remembered on disk for an hour, keyed by a short
+# SHA-256 fingerprint so the key itself is never written out.
+@st.cache_data(ttl=60, max_entries=8, show_spinner=False)
 def test_openai_api_key(api_key):
+    fingerprint = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    now = time.time()
     try:
-        openai.api_key = api_key
-        openai.models.list()
+        with open(API_KEY_CHECK_PATH, 'r') as f:
+            checked = json.load(f)
+    except (OSError, ValueError):
+        checked = {}
+    # Ignore anything that isn't the {fingerprint: timestamp} shape we write
+    if not isinstance(checked, dict) or not all(
+            isinstance(t, (int, float)) and not isinstance(t, bool) for t in checked.values()):
+        checked = {}
+    if now - checked.get(fingerprint, 0) < API_KEY_CHECK_TTL:
         return True, "API key is valid!"
+    try:
+        get_openai_client(api_key).models.list()
     except Exception as e:
         return False, f"API key test failed: {e}"
+    checked = {k: t for k, t in checked.items() if now - t < API_KEY_CHECK_TTL}
+    checked[fingerprint] = now
+    tmp_path = API_KEY_CHECK_PATH + ".tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(checked, f)
+        os.replace(tmp_path, API_KEY_CHECK_PATH)
+    except OSError:
+        pass
+    return True, "API key is valid!"
 
-# Test Minecraft server connection (detailed ping)
-def test_minecraft_server(host, port, username, password):
+# Test Minecraft server connection (detailed ping, cached briefly).
+# Credentials are underscore-prefixed so they stay out of the cache key.
+@st.cache_data(ttl=30, show_spinner="Pinging server…")
+def test_minecraft_server(host, port, _username, _password):
     try:
         server = JavaServer.lookup(f"{host}:{port}")
-        status = server.status()
+        status = asyncio.run(server.async_status())
         info = f"Server is online!\nVersion: {status.version.name}\nMOTD: {status.description}\nPlayers: {status.players.online}/{status.players.max}"
         return True, info
     except Exception as e:
@@ -104,19 +212,25 @@ def test_minecraft_server(host, port, username, password):
 
 # Helper to start/stop agent
 def start_agent():
-    env = os.environ.copy()
-    config = load_config()
-    
     # Use securely stored credentials
+    overrides = {}
     if st.session_state.get("authenticated") and st.session_state.get("api_key"):
-        env["OPENAI_API_KEY"] = st.session_state["api_key"]
+        overrides["OPENAI_API_KEY"] = st.session_state["api_key"]
     if st.session_state.get("authenticated") and st.session_state.get("mc_password"):
-        env["MINECRAFT_PASSWORD"] = st.session_state["mc_password"]
-        
-    # Start agent.py and append output to log (using 'a' instead of 'w' to preserve history)
-    return subprocess.Popen([
-        "python", "agent.py"
-    ], env=env, stdout=open(LOG_PATH, "a"), stderr=subprocess.STDOUT)
+        overrides["MINECRAFT_PASSWORD"] = st.session_state["mc_password"]
+    # env=None lets the child inherit our environment without copying it
+    env = {**os.environ, **overrides} if overrides else None
+
+    # agent.py writes its own rotating log. stderr goes to a separate per-run file
+    # (so it never pins a rotated agent.log) to catch failures before logging is up.
+    # The child inherits its own copy of the descriptor, so close ours right away.
+    stderr_fd = os.open(STDERR_LOG_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        return subprocess.Popen([
+            "python", "agent.py"
+        ], env=env, stdout=subprocess.DEVNULL, stderr=stderr_fd, close_fds=True)
+    finally:
+        os.close(stderr_fd)
 
 def stop_agent(proc):
     if proc and proc.poll() is None:
@@ -126,15 +240,87 @@ def stop_agent(proc):
         except subprocess.TimeoutExpired:
             proc.kill()
 
-def extract_players_from_log(log_lines):
+def _decode_lines(data):
+    return [line.decode('utf-8', errors='replace') for line in data.splitlines(keepends=True)]
+
+LOG_TAIL_MAX_BYTES = 1 << 20  # Most log data read in one refresh
+
+def tail_lines(f, end, n=100, block=65536, max_block=LOG_TAIL_MAX_BYTES):
+    """Return (last n complete lines before offset end, offset just past them).
+
+    The read window doubles until it holds n lines but never exceeds max_block,
+    so a log with very long lines costs at most max_block bytes of memory.
+    """
+    while True:
+        read_size = min(end, block)
+        f.seek(end - read_size)
+        data = f.read(read_size)
+        if read_size == end or block >= max_block or data.count(b'\n') > n:
+            break
+        block = min(block * 2, max_block)
+    complete = data.rfind(b'\n') + 1  # Leave an unfinished last line for the next read
+    if complete == 0 and read_size < end:
+        # The window is the middle of a single oversized line; skip past it
+        return [], end
+    start = data.find(b'\n') + 1 if read_size < end else 0  # First line is probably partial
+    lines = _decode_lines(data[start:complete]) if complete > start else []
+    return lines[-n:], end - read_size + complete
+
+def read_log_lines(path, n=100):
+    """Return the last n log lines, reading only what was appended since the last rerun"""
+    lines = st.session_state.get("_log_lines")
+    offset = st.session_state.get("_log_offset", 0)
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        if lines is None or size < offset or size - offset > LOG_TAIL_MAX_BYTES:
+            # First read, the log was truncated/rotated, or too much was appended
+            # to read in one go: start again from its tail
+            tail, offset = tail_lines(f, size, n)
+            lines = deque(tail, maxlen=n)
+        elif size > offset:
+            f.seek(offset)
+            data = f.read(size - offset)
+            complete = data.rfind(b'\n') + 1
+            lines.extend(_decode_lines(data[:complete]))
+            offset += complete
+        # Don't let repeated log scans crowd other data out of the page cache
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    st.session_state["_log_lines"] = lines
+    st.session_state["_log_offset"] = offset
+    return lines
+
+_PLAYERS_RE = re.compile(r'Online players:[ \t]*(.*)$', re.MULTILINE)
+
+def extract_players_from_log(buf):
     # Find the most recent "Online players:" line
-    for line in reversed(log_lines):
-        if "Online players:" in line:
-            players = line.split("Online players:", 1)[1].strip()
-            if players == "[none]":
-                return []
-            return [p.strip() for p in players.split(",") if p.strip()]
-    return []
+    last = None
+    for m in _PLAYERS_RE.finditer(buf):
+        last = m
+    if last is None:
+        return []
+    players = last.group(1).strip()
+    if players == "[none]":
+        return []
+    return [p.strip() for p in players.split(",") if p.strip()]
+
+def read_players():
+    """Return the player list the agent published, or None if it isn't available"""
+    try:
+        players_stat = os.stat(PLAYERS_PATH)
+    except OSError:
+        return None
+    players_key = (players_stat.st_mtime_ns, players_stat.st_size)
+    if players_key != st.session_state.get("_players_stat"):
+        try:
+            with open(PLAYERS_PATH, 'r') as f:
+                players = json.load(f)["players"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None  # Unreadable or malformed; retried on the next refresh
+        st.session_state["_players_stat"] = players_key
+        st.session_state["_players"] = players
+    return st.session_state["_players"]
 
 # UI Setup and Authentication
 st.title("Minecraft Agent Manager")
@@ -204,6 +390,11 @@ else:
         if st.button("Logout", type="primary"):
             st.session_state["authenticated"] = False
             st.session_state["admin_password"] = ""
+            # Drop decrypted credentials so they can't be used after logout
+            st.session_state["secrets"] = {}
+            st.session_state["api_key"] = ""
+            st.session_state["mc_password"] = ""
+            st.session_state.pop("_fernet_cache", None)  # Derived keys can decrypt the secrets file
             st.rerun()
     
     # Configuration section - only show when authenticated
@@ -214,66 +405,65 @@ else:
     api_key_for_models = st.session_state["api_key"] or os.getenv("OPENAI_API_KEY", "")
     model_options = get_openai_models(api_key_for_models)
     
-    # Configuration form
-    with st.form("config_form"):
-        api_key = st.text_input("OpenAI API Key", 
-                               value=st.session_state["api_key"], 
-                               type="password")
-        test_api = st.form_submit_button("Test API Key", use_container_width=True)
-        if test_api:
-            ok, msg = test_openai_api_key(api_key)
-            if ok:
-                st.success(msg)
-            else:
-                st.error(msg)
-                
-        model = st.selectbox("OpenAI Model", 
-                           options=model_options, 
-                           index=model_options.index(config['openai']['model']) 
-                                 if config['openai']['model'] in model_options else 0)
-        
-        server_host = st.text_input("Minecraft Server Host", 
-                                  value=config['minecraft']['server_host'])
-        server_port = st.number_input("Minecraft Server Port", 
-                                    value=config['minecraft']['server_port'], 
-                                    step=1)
-        username = st.text_input("Agent Username", 
-                              value=config['minecraft']['username'])
-        mc_password = st.text_input("Minecraft Password (if needed)", 
-                                 value=st.session_state["mc_password"], 
-                                 type="password")
-        
-        test_server = st.form_submit_button("Test Server Connection", use_container_width=True)
-        if test_server:
-            ok, msg = test_minecraft_server(server_host, server_port, username, mc_password)
-            if ok:
-                st.success(msg)
-            else:
-                st.error(msg)
-                
-        submitted = st.form_submit_button("Save Configuration")
-        if submitted and st.session_state["authenticated"]:
-            # Update configuration file
-            config['openai']['api_key'] = "${OPENAI_API_KEY}"  # Placeholder in config file
-            config['openai']['model'] = model
-            config['minecraft']['server_host'] = server_host
-            config['minecraft']['server_port'] = int(server_port)
-            config['minecraft']['username'] = username
-            config['minecraft']['password'] = "${MINECRAFT_PASSWORD}"  # Placeholder in config file
-            save_config(config)
+    # Configuration inputs. These are plain widgets rather than an st.form so the
+    # Test buttons can check the current values without submitting (and
+    # re-rendering) the whole form; only Save writes anything.
+    api_key = st.text_input("OpenAI API Key", 
+                           value=st.session_state["api_key"], 
+                           type="password")
+    if st.button("Test API Key", use_container_width=True):
+        ok, msg = test_openai_api_key(api_key)
+        if ok:
+            st.success(msg)
+        else:
+            st.error(msg)
             
-            # Store actual secrets securely
-            st.session_state["secrets"]["openai_api_key"] = api_key
-            st.session_state["secrets"]["minecraft_password"] = mc_password
+    model = st.selectbox("OpenAI Model", 
+                       options=model_options, 
+                       index=model_options.index(config['openai']['model']) 
+                             if config['openai']['model'] in model_options else 0)
+    
+    server_host = st.text_input("Minecraft Server Host", 
+                              value=config['minecraft']['server_host'])
+    server_port = st.number_input("Minecraft Server Port", 
+                                value=config['minecraft']['server_port'], 
+                                step=1)
+    username = st.text_input("Agent Username", 
+                          value=config['minecraft']['username'])
+    mc_password = st.text_input("Minecraft Password (if needed)", 
+                             value=st.session_state["mc_password"], 
+                             type="password")
+    
+    if st.button("Test Server Connection", use_container_width=True):
+        ok, msg = test_minecraft_server(server_host, server_port, username, mc_password)
+        if ok:
+            st.success(msg)
+        else:
+            st.error(msg)
             
-            # Save to encrypted storage
-            if save_secrets(st.session_state["secrets"], st.session_state["admin_password"]):
-                # Update session state
-                st.session_state["api_key"] = api_key
-                st.session_state["mc_password"] = mc_password
-                st.success("Configuration saved securely!")
-            else:
-                st.error("Failed to save secrets securely. Settings not updated.")
+    submitted = st.button("Save Configuration")
+    if submitted and st.session_state["authenticated"]:
+        # Update configuration file
+        config['openai']['api_key'] = "${OPENAI_API_KEY}"  # Placeholder in config file
+        config['openai']['model'] = model
+        config['minecraft']['server_host'] = server_host
+        config['minecraft']['server_port'] = int(server_port)
+        config['minecraft']['username'] = username
+        config['minecraft']['password'] = "${MINECRAFT_PASSWORD}"  # Placeholder in config file
+        save_config(config)
+        
+        # Store actual secrets securely
+        st.session_state["secrets"]["openai_api_key"] = api_key
+        st.session_state["secrets"]["minecraft_password"] = mc_password
+        
+        # Save to encrypted storage
+        if save_secrets(st.session_state["secrets"], st.session_state["admin_password"]):
+            # Update session state
+            st.session_state["api_key"] = api_key
+            st.session_state["mc_password"] = mc_password
+            st.success("Configuration saved securely!")
+        else:
+            st.error("Failed to save secrets securely. Settings not updated.")
 
 # Agent controls
 if "agent_proc" not in st.session_state:
@@ -285,19 +475,16 @@ st.subheader("Agent Controls")
 col1, col2 = st.columns(2)
 with col1:
     if st.session_state["agent_proc"] is None or st.session_state["agent_proc"].poll() is not None:
+        # Surface output from an agent that exited with an error
+        proc = st.session_state["agent_proc"]
+        if proc is not None and proc.returncode and os.path.exists(STDERR_LOG_PATH):
+            with open(STDERR_LOG_PATH, 'rb') as f:
+                stderr_tail, _ = tail_lines(f, f.seek(0, 2), n=20)
+            if stderr_tail:
+                st.error(f"Agent exited with code {proc.returncode}:\n\n" + "".join(stderr_tail))
         if st.button("Start Agent", type="primary"):
-            # Set environment variables from secure storage
-            env = os.environ.copy()
-            if st.session_state.get("api_key"):
-                env["OPENAI_API_KEY"] = st.session_state["api_key"]
-            if st.session_state.get("mc_password"):
-                env["MINECRAFT_PASSWORD"] = st.session_state["mc_password"]
-                
             # Start the agent with the secured credentials
-            st.session_state["agent_proc"] = subprocess.Popen([
-                "python", "agent.py"
-            ], env=env, stdout=open(LOG_PATH, "a"), stderr=subprocess.STDOUT)
-            
+            st.session_state["agent_proc"] = start_agent()
             st.success("Agent started!")
     else:
         st.info("Agent is running")
@@ -311,23 +498,33 @@ with col2:
 # Show agent logs and live player list
 st.subheader("Agent Log & Online Players")
 
-# Auto-refresh every 3 seconds
-st_autorefresh = st.empty()
-log_box = st.empty()
-player_box = st.empty()
+# Refresh only the log/player panel every 3 seconds, not the whole script
+@st.fragment(run_every=3)
+def render_logs():
+    log_box = st.empty()
+    player_box = st.empty()
 
-while True:
     if os.path.exists(LOG_PATH):
-        with open(LOG_PATH, "r") as f:
-            log_lines = f.readlines()[-100:]
+        # Only re-read the log when its mtime or size changed since the last rerun
+        log_stat = os.stat(LOG_PATH)
+        log_key = (log_stat.st_mtime_ns, log_stat.st_size)
+        if log_key != st.session_state.get("_log_stat"):
+            log_lines = read_log_lines(LOG_PATH)
+            st.session_state["_log_stat"] = log_key
+            st.session_state["log_text"] = "".join(log_lines)
+            st.session_state["log_players"] = None
         # Show log
-        log_box.text("".join(log_lines))
-        # Show player list
-        players = extract_players_from_log(log_lines)
+        log_box.text(st.session_state["log_text"])
+        # Show player list, preferring the agent's state file; only scan the
+        # log when that file is missing or unreadable
+        players = read_players()
+        if players is None:
+            if st.session_state.get("log_players") is None:
+                st.session_state["log_players"] = extract_players_from_log(st.session_state["log_text"])
+            players = st.session_state["log_players"]
         player_box.markdown(f"**Online Players:** {', '.join(players) if players else '[none]'}")
     else:
         log_box.info("No log file yet.")
         player_box.markdown("**Online Players:** [none]")
-    # Auto-refresh every 3 seconds
-    time.sleep(3)
-    st_autorefresh.empty() 
\ No newline at end of file
+
+render_logs()